@@ -4,4 +4,5 @@ from .coordinator import Coordinator
 from .partition_server import PartitionServer, FlaskPartitionServer
 from .cluster import Cluster
 from .thread_utils import ServerThread
+from .rpc import RPCServer, RPCClient, RPCClientPool, RPCError
 from .utils import get_open_port, get_host
\ No newline at end of file
@@ -4,9 +4,14 @@ import atexit
 import binascii
 import os
 from time import sleep
+from threading import Thread, Event
+from Queue import Queue, Empty, Full
+import requests
 from .thread_utils import MapPartitionsThread
 from .partition_server import FlaskPartitionServer
 from .coordinator import Coordinator
+from .export_utils import read_export_frames, DEFAULT_BATCH_SIZE
+from .rpc import RPCClientPool, RPCError
 
 
 class Cluster(object):
@@ -39,6 +44,7 @@ class Cluster(object):
         self.coordinator = None
         self._is_active = False
         self.token = None
+        self._rpc_pool = None
 
         def cleanup():
             if self.is_active():
@@ -62,6 +68,13 @@ class Cluster(object):
         else:
             return None
 
+    def get_rpc_hosts(self):
+        """Get a dict mapping partition index to pairs of host and RPC port for partition servers with an RPC listener"""
+        if self.coordinator:
+            return self.coordinator.rpc_hosts
+        else:
+            return None
+
     def start(self, await_hosts=False):
         """Start the cluster
 
@@ -94,6 +107,9 @@ class Cluster(object):
         self.partition_server.set_coordinator_url(coordinator_url)
         self.partition_server.set_token(self.token)
 
+        # Persistent RPC connections are opened lazily on first use
+        self._rpc_pool = RPCClientPool(token=self.token)
+
         # start paritition servers
         self.map_job = MapPartitionsThread(self.rdd, self.partition_server, self.cache_result)
         self.map_job.daemon = True
@@ -108,6 +124,7 @@ class Cluster(object):
         """Stop the cluster"""
         self.coordinator.shutdown_hosts()
         self.coordinator.shutdown()
+        self._rpc_pool.close()
         self._is_active = False
 
     def get_result_rdd(self):
@@ -121,3 +138,142 @@ class Cluster(object):
         else:
             return None
 
+    def export_iter(self, inds=None, offset=0, limit=None, batch_size=DEFAULT_BATCH_SIZE,
+                    max_workers=4, max_pending=None):
+        """Stream partition state from the /control/export route of partition servers
+
+        Up to max_workers partitions are read in parallel and (partition index, batch)
+        pairs are yielded as batches arrive. Batches from a single partition are yielded
+        in order. A batch is a NumPy array if the partition server exports one and a
+        list otherwise.
+
+        At most max_pending + max_workers decoded batches are held on the driver at
+        once: max_pending waiting to be consumed and one in hand per worker.
+
+        :param list inds:
+            partition indices to export, or None for all registered partitions
+        :param int offset:
+            index of the first record to export from each partition
+        :param int limit:
+            maximum number of records to export from each partition, or None for all
+        :param int batch_size:
+            maximum number of records per batch
+        :param int max_workers:
+            maximum number of partitions read at once
+        :param int max_pending:
+            maximum number of batches waiting to be consumed, defaults to max_workers
+        """
+        hosts = self.get_hosts()
+        if hosts is None:
+            raise RuntimeError('Cluster is not running')
+
+        if inds is None:
+            inds = sorted(hosts)
+
+        if not inds:
+            return
+
+        params = {'offset': offset, 'batch_size': batch_size}
+        if limit is not None:
+            params['limit'] = limit
+        if self.token:
+            params['token'] = self.token
+
+        # A bounded queue keeps memory on the driver in check when the consumer
+        # is slower than the partition servers
+        batches = Queue(maxsize=max_pending or max_workers)
+        stopped = Event()
+
+        # A fixed set of workers takes partitions from this queue so that only
+        # max_workers exports are open at a time
+        pending_inds = Queue()
+        for ind in inds:
+            pending_inds.put(ind)
+        done = object()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def export_partition(ind):
+            try:
+                url = 'http://%s:%d/control/export' % hosts[ind]
+                rsp = requests.get(url, params=params, stream=True)
+                try:
+                    rsp.raise_for_status()
+                    for batch in read_export_frames(rsp.raw):
+                        if not put((ind, batch)):
+                            return
+                finally:
+                    rsp.close()
+            except Exception as e:
+                put((ind, e))
+            put((ind, done))
+
+        def thread_target():
+            while not stopped.is_set():
+                try:
+                    ind = pending_inds.get_nowait()
+                except Empty:
+                    return
+                export_partition(ind)
+
+        for _ in xrange(min(max_workers, len(inds))):
+            thread = Thread(target=thread_target)
+            thread.daemon = True
+            thread.start()
+
+        remaining = len(inds)
+        try:
+            while remaining:
+                ind, batch = batches.get()
+                if batch is done:
+                    remaining -= 1
+                elif isinstance(batch, Exception):
+                    raise batch
+                else:
+                    yield ind, batch
+        finally:
+            # Release any export threads blocked on a full queue
+            stopped.set()
+
+    def _get_rpc_client(self, ind):
+        """Get the pooled RPC connection to the partition server on a given partition"""
+        rpc_hosts = self.get_rpc_hosts()
+        if not rpc_hosts or ind not in rpc_hosts:
+            raise RPCError('Partition %d has no registered RPC listener' % ind)
+        return self._rpc_pool.get(*rpc_hosts[ind])
+
+    def rpc_call(self, ind, method, args=(), timeout=None):
+        """Call an RPC handler on the partition server on a given partition and return the result
+
+        :param int ind:
+            the partition index
+        :param str method:
+            the name of the RPC handler
+        :param tuple args:
+            arguments for the handler
+        :param float timeout:
+            an optional timeout in seconds to wait for the response
+        """
+        return self._get_rpc_client(ind).call(method, args, timeout)
+
+    def rpc_batch(self, calls, timeout=None):
+        """Make many RPC calls, pipelined over one persistent connection per partition server
+
+        All requests are sent before any response is awaited, so the batch costs roughly
+        one round trip rather than one per call. Results are returned in the order of calls.
+        An RPCError is raised if any call fails.
+
+        :param list calls:
+            a list of (partition index, method name, args tuple) triples
+        :param float timeout:
+            an optional timeout in seconds to wait for each response
+        """
+        futures = [self._get_rpc_client(ind).call_async(method, args) for ind, method, args in calls]
+        return [future.result(timeout) for future in futures]
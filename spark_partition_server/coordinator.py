@@ -17,7 +17,9 @@ class Coordinator(ServerThread):
 
     In order to register, hosts must POST a json object containing
     keys 'partition', 'host', and 'port' to the /register route of
-    the Coordinator. The Coordinator can shutdown all hosts when
+    the Coordinator. Hosts that run an RPC listener also provide an
+    'rpc_port' key, and are tracked in a separate rpc_hosts dict.
+    The Coordinator can shutdown all hosts when
     Coordinator.shutdown_hosts is called so long as all hosts provide
     a /control/shutdown route.
 
@@ -28,6 +30,7 @@ class Coordinator(ServerThread):
         self.await_partitions = await_partitions
         self.verbose = verbose
         self.hosts = {}
+        self.rpc_hosts = {}
         self.token = token
         self.register_callback = None
 
@@ -53,6 +56,7 @@ class Coordinator(ServerThread):
 
             j = request.get_json()
             partition, host, port = j['partition'], j['host'], j['port']
+            rpc_port = j.get('rpc_port')
 
             old_entry = None
             if partition in self.hosts:
@@ -60,8 +64,17 @@ class Coordinator(ServerThread):
 
             self.hosts[partition] = (host, port)
 
+            # A restarted partition may come back without an RPC listener
+            if rpc_port is not None:
+                self.rpc_hosts[partition] = (host, rpc_port)
+            else:
+                self.rpc_hosts.pop(partition, None)
+
             if self.verbose:
-                print 'Registered partition %d at http://%s:%d' % (partition, host, port)
+                if rpc_port is not None:
+                    print 'Registered partition %d at http://%s:%d with RPC port %d' % (partition, host, port, rpc_port)
+                else:
+                    print 'Registered partition %d at http://%s:%d' % (partition, host, port)
 
             if self.await_partitions == len(self.hosts):
                 self.full_cluster = True
@@ -84,7 +97,8 @@ class Coordinator(ServerThread):
             return jsonify({
                 'expected_partitions': self.await_partitions,
                 'full_cluster': self.full_cluster,
-                'hosts': self.hosts
+                'hosts': self.hosts,
+                'rpc_hosts': self.rpc_hosts
             })
 
         @self.app.route('/status', methods=['GET'])
@@ -103,6 +117,7 @@ class Coordinator(ServerThread):
                 url = '%s?token=%s' % (url, self.token)
             requests.post(url)
             del self.hosts[ind]
+            self.rpc_hosts.pop(ind, None)
 
     def shutdown_hosts(self):
         """Shutdown all hosts"""
@@ -123,6 +138,7 @@ class Coordinator(ServerThread):
 
         # Reset cluster state
         self.hosts = {}
+        self.rpc_hosts = {}
         self.full_cluster = False if self.await_partitions else None
 
     def print_hosts(self):
@@ -0,0 +1,116 @@
+# Copyright 2016, Yahoo Inc.
+# Licensed under the terms of the Apache License, Version 2.0. See the LICENSE file associated with the project for terms.
+import io
+import struct
+from itertools import islice
+from .utils import read_exact
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Each frame is a one byte format tag followed by the payload length as an
+# unsigned 64-bit big-endian integer and then the payload itself.
+FRAME_HEADER = struct.Struct('>cQ')
+
+FRAME_NUMPY = b'N'
+FRAME_PICKLE = b'P'
+FRAME_END = b'E'
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _encode_batch(batch):
+    """Encode a batch of records as a (tag, payload) pair"""
+    if np is not None and isinstance(batch, np.ndarray) and not batch.dtype.hasobject:
+        buf = io.BytesIO()
+        np.lib.format.write_array(buf, batch, allow_pickle=False)
+        return FRAME_NUMPY, buf.getvalue()
+    else:
+        return FRAME_PICKLE, pickle.dumps(list(batch), pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_batch(tag, payload):
+    """Decode a batch of records from a tag and payload"""
+    if tag == FRAME_NUMPY:
+        if np is None:
+            raise RuntimeError('Received a NumPy record batch but NumPy is not installed')
+        return np.lib.format.read_array(io.BytesIO(payload), allow_pickle=False)
+    elif tag == FRAME_PICKLE:
+        return pickle.loads(payload)
+    else:
+        raise ValueError('Unknown export frame tag %r' % tag)
+
+
+def _iter_batches(data, offset, limit, batch_size):
+    """Split the [offset, offset + limit) range of data into batches
+
+    Lists, tuples, and NumPy arrays are sliced directly so that NumPy
+    batches stay as arrays. Any other iterable is consumed lazily.
+    """
+    stop = None if limit is None else offset + limit
+
+    if isinstance(data, (list, tuple)) or (np is not None and isinstance(data, np.ndarray)):
+        end = len(data) if stop is None else min(stop, len(data))
+        for start in xrange(offset, end, batch_size):
+            yield data[start:min(start + batch_size, end)]
+    else:
+        itr = islice(data, offset, stop)
+        while True:
+            batch = list(islice(itr, batch_size))
+            if not batch:
+                break
+            yield batch
+
+
+def iter_export_frames(data, offset=0, limit=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Generate length-prefixed binary frames for a range of records
+
+    NumPy arrays are sent as NumPy buffers, anything else is pickled. The
+    stream is terminated by an empty end frame so that clients can tell a
+    complete export from a dropped connection.
+
+    :param data:
+        a sequence or iterable of records
+    :param int offset:
+        index of the first record to export
+    :param int limit:
+        maximum number of records to export, or None for all remaining records
+    :param int batch_size:
+        maximum number of records per frame
+    """
+    for batch in _iter_batches(data, offset, limit, batch_size):
+        tag, payload = _encode_batch(batch)
+        yield FRAME_HEADER.pack(tag, len(payload))
+        yield payload
+
+    yield FRAME_HEADER.pack(FRAME_END, 0)
+
+
+def read_export_frames(fileobj):
+    """Generate record batches from a stream of export frames
+
+    :param fileobj:
+        a file-like object, such as the raw stream of a requests response
+    """
+    while True:
+        header = read_exact(fileobj, FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            raise IOError('Export stream ended before the end frame')
+
+        tag, length = FRAME_HEADER.unpack(header)
+        if tag == FRAME_END:
+            return
+
+        payload = read_exact(fileobj, length)
+        if len(payload) < length:
+            raise IOError('Export stream ended in the middle of a frame')
+
+        yield _decode_batch(tag, payload)
@@ -2,6 +2,8 @@
 # Licensed under the terms of the Apache License, Version 2.0. See the LICENSE file associated with the project for terms.
 import requests
 from .utils import get_open_port, get_host
+from .export_utils import iter_export_frames, DEFAULT_BATCH_SIZE
+from .rpc import RPCServer
 
 
 class PartitionServer(object):
@@ -12,16 +14,26 @@ class PartitionServer(object):
     a lambda to RDD.mapPartitionsWithIndex and should not return until the server
     is shutdown.
     """
-    def __init__(self, port=None, config={}):
+    def __init__(self, port=None, config={}, rpc_handlers=None, rpc_port=None):
         """
         :param int port:
             an optional port
         :param dict config:
             an optional dict of configuration data
+        :param dict rpc_handlers:
+            an optional dict mapping method names to functions to serve over
+            the binary RPC transport; the RPC listener only runs if handlers
+            are registered by the time the server registers with the
+            coordinator, and it requires a cluster token
+        :param int rpc_port:
+            an optional port for the RPC listener
         """
         self.port = port
         self.config = config
         self.token = None
+        self.rpc_handlers = dict(rpc_handlers) if rpc_handlers else {}
+        self.rpc_port = rpc_port
+        self.rpc_server = None
 
     def set_coordinator_url(self, url):
         """
@@ -33,6 +45,27 @@ class PartitionServer(object):
     def set_token(self, token):
         self.token = token
 
+    def register_rpc_handler(self, name, fn):
+        """Register a function to be called by Cluster.rpc_call with the given method name
+
+        Handlers may be registered on the driver or on the executor (eg. in
+        init_partition) up until _register is called.
+        """
+        self.rpc_handlers[name] = fn
+
+    def _start_rpc_server(self):
+        """Start an RPC listener if any RPC handlers are registered"""
+        if not self.rpc_handlers or self.rpc_server is not None:
+            return
+
+        # RPC requests are unpickled, so never accept them from unauthenticated peers
+        if not self.token:
+            raise RuntimeError('An RPC listener requires a cluster token, start partition servers with Cluster.start')
+
+        self.rpc_server = RPCServer(self.rpc_handlers, port=self.rpc_port, token=self.token)
+        self.rpc_server.daemon = True
+        self.rpc_server.start()
+
     def _register(self):
         """Register with coordinator"""
         # TODO: if this partition is empty, tell the coordinator
@@ -41,7 +74,10 @@ class PartitionServer(object):
         if self.token:
             url = '%s?token=%s' % (url, self.token)
 
-        requests.post(url, json={ "partition": self.partition_ind, "host": self.host, "port": self.port })
+        self._start_rpc_server()
+        rpc_port = self.rpc_server.port if self.rpc_server else None
+
+        requests.post(url, json={ "partition": self.partition_ind, "host": self.host, "port": self.port, "rpc_port": rpc_port })
 
     def __call__(self, ind, itr):
         """
@@ -51,6 +87,9 @@ class PartitionServer(object):
         When it exits, it will call _build_result which can also be
         overridden by subclasses to return an iterable containing any
         state that should be saved.
+
+        If RPC handlers are registered, an RPC listener is started by
+        _register and stopped after _launch_server returns.
         """
         self.partition_ind = ind;
         self.itr = itr
@@ -58,7 +97,12 @@ class PartitionServer(object):
         if self.port is None:
             self.port = get_open_port()
 
-        self._launch_server()
+        try:
+            self._launch_server()
+        finally:
+            if self.rpc_server:
+                self.rpc_server.shutdown()
+                self.rpc_server = None
 
         return self._build_result()
 
@@ -66,12 +110,25 @@ class PartitionServer(object):
         """Override to return state after the server is terminated"""
         return []
 
+    def get_export_data(self):
+        """Override to return the partition state served by /control/export
+
+        This should be a re-iterable collection of records, such as a list or
+        a NumPy array. Exports may run concurrently and repeatedly, so one-shot
+        iterators (like generators or the partition iterator) are rejected.
+        NumPy arrays are exported as NumPy buffers and anything else is
+        pickled. Return None if there is nothing to export.
+        """
+        return None
+
     def _launch_server(self):
         """Implement this method to start a server or perform work on the partition
 
         Subclasses must call self._register() in this method to register with the
         Coordinator. They also must launch an HTTP server on self.port with a
-        /control/shutdown POST endpoint to respond to shutdown requests. Otherwise,
+        /control/shutdown POST endpoint to respond to shutdown requests. Subclasses
+        that support Cluster.export_iter should also provide a /control/export GET
+        endpoint that streams iter_export_frames over self.get_export_data(). Otherwise,
         subclasses are free to implement any suitable application logic.
         """
         raise NotImplementedError
@@ -144,6 +201,33 @@ class FlaskPartitionServer(PartitionServer):
             func()
             return 'Server shutting down...'
 
+        @app.route('/control/export', methods=['GET'])
+        def export():
+
+            # Check request token
+            if self.token and self.token != request.args.get('token'):
+                return Response(status=403)
+
+            offset = request.args.get('offset', 0, type=int)
+            limit = request.args.get('limit', None, type=int)
+            batch_size = request.args.get('batch_size', DEFAULT_BATCH_SIZE, type=int)
+
+            # Validate before streaming since errors can't be reported once the response has started
+            if offset < 0 or (limit is not None and limit < 0) or batch_size <= 0:
+                return Response(status=400)
+
+            data = self.get_export_data()
+            if data is None:
+                return Response(status=404)
+
+            # A one-shot iterator would be empty on a second export and can't be shared between threads
+            if iter(data) is data:
+                return Response('get_export_data must return a re-iterable collection, not an iterator', status=500)
+
+            # Stream frames as they are built rather than buffering the partition
+            frames = iter_export_frames(data, offset, limit, batch_size)
+            return Response(frames, mimetype='application/octet-stream')
+
         @app.route('/control/ping', methods=['POST', 'GET'])
         def ping():
             return Response(status=200)
@@ -153,6 +237,15 @@ class FlaskPartitionServer(PartitionServer):
         # start server
         app.run(threaded=True, host='0.0.0.0', port=self.port)
 
+    def get_export_data(self):
+        """Export the EXPORT_DATA app config value unless overridden by a subclass
+
+        This lets an init function set up exportable state without subclassing.
+        """
+        if self.app is None:
+            return None
+        return self.app.config.get('EXPORT_DATA')
+
     def set_shutdown_callback(self, fn):
         self.shutdown_callback = fn
 
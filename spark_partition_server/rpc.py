@@ -0,0 +1,477 @@
+# Copyright 2016, Yahoo Inc.
+# Licensed under the terms of the Apache License, Version 2.0. See the LICENSE file associated with the project for terms.
+import hmac
+import itertools
+import socket
+import struct
+from threading import Thread, Lock, Event
+from Queue import Queue
+from .utils import read_exact
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# Each frame is the payload length as an unsigned 64-bit big-endian integer
+# followed by a 64-bit request ID and then the payload itself.
+FRAME_HEADER = struct.Struct('>QQ')
+
+# The first frame on a connection authenticates the client with the cluster
+# token. It is not pickled so nothing is unpickled from unauthenticated peers.
+AUTH_REQUEST_ID = 0
+AUTH_OK = b'OK'
+
+# Seconds a new connection has to authenticate before it is dropped
+AUTH_TIMEOUT = 10.0
+
+DEFAULT_MAX_REQUEST_SIZE = 256 * 1024 * 1024
+
+
+class RPCError(Exception):
+    """Raised when a remote call fails or its connection is lost"""
+    pass
+
+
+def _send_frame(sock, lock, request_id, payload):
+    """Send a single frame, holding lock so frames from several threads don't interleave"""
+    with lock:
+        sock.sendall(FRAME_HEADER.pack(len(payload), request_id) + payload)
+
+
+def _error_payload(message, e):
+    """Build the payload of a response for a failed request"""
+    return pickle.dumps((False, '%s: %s: %s' % (message, type(e).__name__, e)), pickle.HIGHEST_PROTOCOL)
+
+
+def _recv_header(fileobj):
+    """Receive a frame header as a (length, request_id) pair, or None if the connection was closed"""
+    header = read_exact(fileobj, FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise IOError('RPC connection closed in the middle of a frame')
+    return FRAME_HEADER.unpack(header)
+
+
+def _recv_payload(fileobj, length):
+    """Receive a frame payload of the given length"""
+    payload = read_exact(fileobj, length)
+    if len(payload) < length:
+        raise IOError('RPC connection closed in the middle of a frame')
+    return payload
+
+
+def _discard_payload(fileobj, length, chunk_size=65536):
+    """Read and drop a frame payload without holding all of it in memory"""
+    while length > 0:
+        length -= len(_recv_payload(fileobj, min(length, chunk_size)))
+
+
+def _recv_frame(fileobj):
+    """Receive a single frame as a (request_id, payload) pair, or None if the connection was closed"""
+    header = _recv_header(fileobj)
+    if header is None:
+        return None
+    length, request_id = header
+    return request_id, _recv_payload(fileobj, length)
+
+
+class RPCServer(Thread):
+    """
+    An RPCServer accepts persistent TCP connections and dispatches framed
+    requests to a dict of handler functions by name.
+
+    Clients may send many requests on a connection without waiting for
+    responses. Requests are handled by a pool of worker threads and each
+    response carries the ID of its request, so responses may arrive out
+    of order.
+
+    An RPCServer is started by calling its `start` method, which binds the
+    listening socket so that `port` is known once it returns. Calling its
+    `shutdown` method closes the listener and all open connections.
+
+    Requests are pickled, so the server requires a token and only unpickles
+    frames from connections that have authenticated with it. Requests larger
+    than max_request_size are rejected without being buffered.
+    """
+    def __init__(self, handlers, port=None, token=None, num_workers=4,
+                 max_request_size=DEFAULT_MAX_REQUEST_SIZE):
+        """
+        :param dict handlers:
+            a dict mapping method names to functions
+        :param int port:
+            an optional port, an open port is chosen if not provided
+        :param str token:
+            a token that clients must provide to connect
+        :param int num_workers:
+            number of threads handling requests
+        :param int max_request_size:
+            maximum size in bytes of a pickled request
+        """
+        if not token:
+            raise ValueError('RPCServer requires a token')
+
+        super(RPCServer, self).__init__()
+        self.handlers = handlers
+        self.port = port
+        self.token = token
+        self.num_workers = num_workers
+        self.max_request_size = max_request_size
+
+        self._socket = None
+        self._requests = Queue()
+        self._connections = set()
+        self._connections_lock = Lock()
+        self._stopped = Event()
+
+    def start(self):
+        """Bind the listening socket and start serving in separate threads"""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('0.0.0.0', self.port or 0))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+
+        for _ in xrange(self.num_workers):
+            worker = Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+        super(RPCServer, self).start()
+
+    def run(self):
+        """
+        This overrides Thread.run and shouldn't be called directly. Call the
+        `start` method to start the server in a separate thread.
+        """
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._socket.accept()
+            except socket.error:
+                # The listening socket was closed by shutdown
+                break
+
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._connections_lock:
+                self._connections.add(conn)
+
+            thread = Thread(target=self._serve_connection, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def shutdown(self):
+        """Stop accepting connections and close all open connections"""
+        self._stopped.set()
+
+        with self._connections_lock:
+            sockets = [self._socket] + list(self._connections)
+            self._connections.clear()
+
+        # shutdown wakes up threads blocked in accept or recv, close alone does not
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+
+        for _ in xrange(self.num_workers):
+            self._requests.put(None)
+
+    def _authenticate(self, conn, fileobj, send_lock):
+        # The peer is untrusted until this returns, so bound both the time
+        # and the memory it can make this connection use
+        conn.settimeout(AUTH_TIMEOUT)
+
+        header = _recv_header(fileobj)
+        if header is None:
+            return False
+        length, request_id = header
+        if request_id != AUTH_REQUEST_ID or length != len(self.token):
+            return False
+        if not hmac.compare_digest(_recv_payload(fileobj, length), self.token):
+            return False
+
+        conn.settimeout(None)
+        _send_frame(conn, send_lock, AUTH_REQUEST_ID, AUTH_OK)
+        return True
+
+    def _serve_connection(self, conn):
+        """Read requests from a connection and queue them for the workers"""
+        send_lock = Lock()
+        fileobj = conn.makefile('rb')
+        try:
+            if not self._authenticate(conn, fileobj, send_lock):
+                return
+
+            while True:
+                header = _recv_header(fileobj)
+                if header is None:
+                    break
+                length, request_id = header
+
+                if length > self.max_request_size:
+                    _discard_payload(fileobj, length)
+                    _send_frame(conn, send_lock, request_id, _error_payload(
+                        'Bad RPC request', RPCError('%d byte request exceeds the maximum of %d' % (length, self.max_request_size))))
+                    continue
+
+                payload = _recv_payload(fileobj, length)
+
+                # A request that can't be decoded fails on its own without
+                # dropping the other requests in flight on this connection
+                try:
+                    method, args = pickle.loads(payload)
+                except Exception as e:
+                    _send_frame(conn, send_lock, request_id, _error_payload('Bad RPC request', e))
+                    continue
+
+                self._requests.put((conn, send_lock, request_id, method, args))
+        except (socket.error, IOError):
+            pass
+        finally:
+            with self._connections_lock:
+                self._connections.discard(conn)
+            fileobj.close()
+            conn.close()
+
+    def _work(self):
+        """Handle queued requests until shutdown"""
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+
+            conn, send_lock, request_id, method, args = item
+            try:
+                if method not in self.handlers:
+                    raise RPCError('Unknown RPC method %s' % method)
+                payload = pickle.dumps((True, self.handlers[method](*args)), pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                payload = _error_payload('RPC method %s failed' % method, e)
+
+            try:
+                _send_frame(conn, send_lock, request_id, payload)
+            except socket.error:
+                # The client went away, there is nobody to respond to
+                pass
+            except Exception as e:
+                # Keep the worker alive and don't leave the caller waiting
+                try:
+                    _send_frame(conn, send_lock, request_id, _error_payload('Sending RPC response failed', e))
+                except socket.error:
+                    pass
+
+
+class RPCFuture(object):
+    """The pending result of a call made with RPCClient.call_async"""
+    def __init__(self, discard=None):
+        self._discard = discard
+        self._event = Event()
+        self._ok = None
+        self._value = None
+
+    def _set(self, ok, value):
+        self._ok = ok
+        self._value = value
+        self._event.set()
+
+    def done(self):
+        """Return whether the response has arrived"""
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the response and return the result, raising RPCError if the call failed"""
+        if not self._event.wait(timeout):
+            # Stop tracking the call, a late response will be dropped
+            if self._discard is not None:
+                self._discard()
+            raise RPCError('Timed out waiting for RPC response')
+        if not self._ok:
+            raise RPCError(self._value)
+        return self._value
+
+
+class RPCClient(object):
+    """
+    An RPCClient holds a persistent connection to an RPCServer. Any number of
+    calls may be outstanding on the connection at once; a reader thread
+    matches responses to calls by request ID.
+    """
+    def __init__(self, host, port, token=None, timeout=None):
+        """
+        :param str host:
+            the server host
+        :param int port:
+            the server RPC port
+        :param str token:
+            an optional token to authenticate with the server
+        :param float timeout:
+            an optional timeout for establishing the connection
+        """
+        self.host = host
+        self.port = port
+
+        self._socket = socket.create_connection((host, port), timeout)
+        self._socket.settimeout(None)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._fileobj = self._socket.makefile('rb')
+
+        self._send_lock = Lock()
+        self._pending = {}
+        self._pending_lock = Lock()
+        self._ids = itertools.count(AUTH_REQUEST_ID + 1)
+        self._closed = False
+
+        self._authenticate(token)
+
+        self._reader = Thread(target=self._read_responses)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _authenticate(self, token):
+        try:
+            _send_frame(self._socket, self._send_lock, AUTH_REQUEST_ID, token or b'')
+            frame = _recv_frame(self._fileobj)
+        except (socket.error, IOError):
+            frame = None
+
+        if frame != (AUTH_REQUEST_ID, AUTH_OK):
+            self.close()
+            raise RPCError('RPC authentication with %s:%d failed' % (self.host, self.port))
+
+    def call_async(self, method, args=()):
+        """Send a request without waiting for the response and return an RPCFuture"""
+        payload = pickle.dumps((method, tuple(args)), pickle.HIGHEST_PROTOCOL)
+
+        with self._pending_lock:
+            if self._closed:
+                raise RPCError('RPC connection to %s:%d is closed' % (self.host, self.port))
+            request_id = next(self._ids)
+            future = RPCFuture(discard=lambda: self._discard(request_id))
+            self._pending[request_id] = future
+
+        try:
+            _send_frame(self._socket, self._send_lock, request_id, payload)
+        except socket.error:
+            # The reader thread fails all pending calls once the socket is closed
+            self.close()
+
+        return future
+
+    def call(self, method, args=(), timeout=None):
+        """Call a method on the server and wait for the result
+
+        :param str method:
+            the name of the RPC handler
+        :param tuple args:
+            arguments for the handler
+        :param float timeout:
+            an optional timeout in seconds to wait for the response
+        """
+        return self.call_async(method, args).result(timeout)
+
+    def _discard(self, request_id):
+        """Stop tracking a pending call"""
+        with self._pending_lock:
+            self._pending.pop(request_id, None)
+
+    def _read_responses(self):
+        """Resolve pending calls as responses arrive until the connection closes"""
+        error = 'RPC connection to %s:%d closed' % (self.host, self.port)
+        try:
+            while True:
+                frame = _recv_frame(self._fileobj)
+                if frame is None:
+                    break
+                request_id, payload = frame
+
+                with self._pending_lock:
+                    future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+
+                # A response that can't be decoded here (eg. its class can't be
+                # imported on the driver) only fails its own call
+                try:
+                    ok, value = pickle.loads(payload)
+                except Exception as e:
+                    ok, value = False, 'Bad RPC response: %s: %s' % (type(e).__name__, e)
+                future._set(ok, value)
+        except (socket.error, IOError) as e:
+            error = 'RPC connection to %s:%d lost: %s' % (self.host, self.port, e)
+        except Exception as e:
+            error = 'RPC connection to %s:%d failed: %s: %s' % (self.host, self.port, type(e).__name__, e)
+            raise
+        finally:
+            # Whatever stopped the reader, make sure the pool stops handing
+            # out this client and nobody waits on a response that won't come
+            with self._pending_lock:
+                self._closed = True
+                pending, self._pending = self._pending, {}
+
+            for future in pending.itervalues():
+                future._set(False, error)
+
+            self.close()
+
+    def is_closed(self):
+        """Return whether the connection has been closed"""
+        return self._closed
+
+    def close(self):
+        """Close the connection, failing any outstanding calls"""
+        with self._pending_lock:
+            self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
+
+
+class RPCClientPool(object):
+    """
+    An RPCClientPool keeps one persistent RPCClient per server, opening
+    connections on first use and replacing them if they are closed.
+    """
+    def __init__(self, token=None, timeout=None):
+        """
+        :param str token:
+            an optional token to authenticate with servers
+        :param float timeout:
+            an optional timeout for establishing connections
+        """
+        self.token = token
+        self.timeout = timeout
+        self._clients = {}
+        self._lock = Lock()
+
+    def get(self, host, port):
+        """Get a connected RPCClient for a server"""
+        key = (host, port)
+        with self._lock:
+            client = self._clients.get(key)
+        if client is not None and not client.is_closed():
+            return client
+
+        # Connect without holding the lock so connections to several servers can be opened in parallel
+        client = RPCClient(host, port, self.token, self.timeout)
+
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None and not existing.is_closed():
+                client.close()
+                return existing
+            self._clients[key] = client
+        return client
+
+    def close(self):
+        """Close all connections"""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.itervalues():
+            client.close()
@@ -19,3 +19,19 @@ def get_open_port():
 def get_host():
     """Get the current hostname"""
     return socket.getfqdn()
+
+
+def read_exact(fileobj, n):
+    """Read exactly n bytes from a file-like object
+
+    Returns fewer than n bytes only if the stream ends first.
+    """
+    chunks = []
+    remaining = n
+    while remaining > 0:
+        chunk = fileobj.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
@@ -0,0 +1,105 @@
+# Copyright 2016, Yahoo Inc.
+# Licensed under the terms of the Apache License, Version 2.0. See the LICENSE file associated with the project for terms.
+import socket
+import time
+import unittest
+from spark_partition_server.rpc import RPCServer, RPCClient, RPCError, FRAME_HEADER
+
+
+TOKEN = b'secret'
+
+
+def _fail_to_unpickle():
+    raise ImportError('No module named missing_on_driver')
+
+
+class Undecodable(object):
+    """Pickles fine on the server but can't be unpickled by the client"""
+    def __reduce__(self):
+        return _fail_to_unpickle, ()
+
+
+def _fail(message):
+    raise ValueError(message)
+
+
+class RPCTest(unittest.TestCase):
+
+    def setUp(self):
+        handlers = {
+            'add': lambda a, b: a + b,
+            'slow': lambda x: time.sleep(0.2) or x,
+            'fail': _fail,
+            'undecodable': Undecodable,
+        }
+        self.server = RPCServer(handlers, token=TOKEN, max_request_size=1024)
+        self.server.daemon = True
+        self.server.start()
+        self.client = RPCClient('127.0.0.1', self.server.port, TOKEN)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+
+    def test_round_trip(self):
+        self.assertEqual(self.client.call('add', (1, 2)), 3)
+
+    def test_pipelined_calls(self):
+        start = time.time()
+        futures = [self.client.call_async('slow', (i,)) for i in range(4)]
+        self.assertEqual([f.result(5) for f in futures], [0, 1, 2, 3])
+
+        # The server's workers handle the pipelined calls concurrently
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_handler_error(self):
+        with self.assertRaises(RPCError) as ctx:
+            self.client.call('fail', ('boom',))
+        self.assertIn('boom', str(ctx.exception))
+        self.assertEqual(self.client.call('add', (1, 1)), 2)
+
+    def test_unknown_method(self):
+        with self.assertRaises(RPCError) as ctx:
+            self.client.call('missing')
+        self.assertIn('Unknown RPC method missing', str(ctx.exception))
+
+    def test_bad_token(self):
+        with self.assertRaises(RPCError):
+            RPCClient('127.0.0.1', self.server.port, b'wrong!')
+
+    def test_undecodable_response(self):
+        slow = self.client.call_async('slow', (7,))
+        with self.assertRaises(RPCError) as ctx:
+            self.client.call('undecodable', timeout=5)
+        self.assertIn('ImportError', str(ctx.exception))
+
+        # Other calls on the connection are unaffected
+        self.assertEqual(slow.result(5), 7)
+        self.assertFalse(self.client.is_closed())
+        self.assertEqual(self.client.call('add', (2, 3), timeout=5), 5)
+
+    def test_timeout_discards_pending_call(self):
+        with self.assertRaises(RPCError):
+            self.client.call('slow', (1,), timeout=0.01)
+        self.assertEqual(len(self.client._pending), 0)
+
+    def test_oversized_request(self):
+        with self.assertRaises(RPCError) as ctx:
+            self.client.call('add', ('x' * 2048, ''), timeout=5)
+        self.assertIn('exceeds the maximum', str(ctx.exception))
+        self.assertEqual(self.client.call('add', (1, 2), timeout=5), 3)
+
+    def test_oversized_auth_frame(self):
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        try:
+            sock.sendall(FRAME_HEADER.pack(2 ** 40, 0))
+            sock.settimeout(5)
+            self.assertEqual(sock.recv(1), b'')
+        finally:
+            sock.close()
+
+        self.assertEqual(self.client.call('add', (1, 2), timeout=5), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()